@@ -0,0 +1,315 @@
+"""
+Earley's algorithm over int-encoded items, compiled with numba.
+
+This is the same weighted Earley parser as EarleyChart._run_earley in
+parse.py -- same lookahead filter, same reprocessing order, same Leo
+chains (see EarleyChart._leo_item), same tie breaking -- but written as
+a single loop over numpy arrays so that numba can compile it.  parse.py
+imports this module only if numba is installed, and turns the arrays it
+returns back into chart columns for printing.
+
+All items of the chart live in one array, column after column: row g of
+`rows` holds (rule, dot, start, parent, child) and `weights[g]` its weight.
+The parse is bound by memory traffic rather than arithmetic, so rows are
+int32, half the bytes per item of int64; items are only packed into int64
+keys (as in parse.pack_item) for duplicate detection.
+parent and child are backpointers in the same convention as Agenda.bp_parent
+and Agenda.bp_child, i.e., row numbers *within* their own columns, with
+LEO_CHILD - row as the child of an item built at the top of a Leo chain.
+"""
+
+from __future__ import annotations
+from typing import List, Tuple
+
+import numpy as np
+from numba import njit, types
+from numba.typed import Dict
+
+RULE, DOT, START, PARENT, CHILD = 0, 1, 2, 3, 4  # columns of the rows array
+ROW_DTYPE = np.int32
+NO_ROW = -1
+LEO_CHILD = -2  # as in parse.py
+DOT_SHIFT, RULE_SHIFT = 16, 24  # items are packed into ints as in parse.pack_item
+
+
+class GrammarArrays:
+    """The parts of a Grammar that the kernel needs, as flat numpy arrays.
+    Rule r has right-hand side rhs_flat[rhs_off[r]:rhs_off[r+1]], and
+    nonterminal A has the rules exp_flat[exp_off[A]:exp_off[A+1]].
+    left_corner[lc_row[A], t] says whether terminal t is a left corner of
+    nonterminal A (lc_row is -1 for terminals)."""
+
+    def __init__(self, grammar) -> None:
+        num_symbols = len(grammar.is_nt)
+        self.rule_lhs = np.array(grammar.rule_lhs, dtype=np.int32)
+        self.rhs_off = np.cumsum([0] + [len(rhs) for rhs in grammar.rule_rhs]).astype(np.int32)
+        self.rhs_flat = np.array([s for rhs in grammar.rule_rhs for s in rhs], dtype=np.int32)
+        self.rule_weight = np.array(grammar.rule_weight, dtype=np.float64)
+        self.is_nt = np.array(grammar.is_nt, dtype=np.uint8)
+        self.exp_off, self.exp_flat = _flatten(
+            [grammar._expansions.get(symbol, []) for symbol in range(num_symbols)])
+        self.lc_row = np.full(num_symbols, -1, dtype=np.int32)
+        self.left_corner = np.zeros((len(grammar.left_corners), num_symbols), dtype=np.uint8)
+        for row, (nonterminal, terminals) in enumerate(grammar.left_corners.items()):
+            self.lc_row[nonterminal] = row
+            self.left_corner[row, list(terminals)] = 1
+
+
+def _flatten(lists: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate lists into one array, with offsets saying where each starts."""
+    off = np.cumsum([0] + [len(lst) for lst in lists]).astype(np.int32)
+    flat = np.array([x for lst in lists for x in lst], dtype=np.int32)
+    return off, flat
+
+
+def run_earley(arrays: GrammarArrays, start_symbol: int, token_ids: List[int]):
+    """Fill in the chart for the sentence; returns (col_off, rows, weights),
+    where column i consists of rows col_off[i] to col_off[i+1]-1."""
+    tokens = np.array(token_ids, dtype=np.int32)
+    return _earley(arrays.rule_lhs, arrays.rhs_off, arrays.rhs_flat, arrays.rule_weight,
+                   arrays.is_nt, arrays.exp_off, arrays.exp_flat,
+                   arrays.lc_row, arrays.left_corner,
+                   start_symbol, tokens)
+
+
+@njit(cache=True)
+def _reserve(rows, weights, need):
+    """Make sure there is room for `need` rows, doubling the arrays if not."""
+    if need <= rows.shape[0]:
+        return rows, weights
+    capacity = max(need, 2 * rows.shape[0])
+    new_rows = np.empty((capacity, 5), ROW_DTYPE)
+    new_rows[:rows.shape[0]] = rows
+    new_weights = np.empty(capacity, np.float64)
+    new_weights[:weights.shape[0]] = weights
+    return new_rows, new_weights
+
+
+@njit(cache=True)
+def _offer(rows, weights, size, index, key, rule, dot, start, weight, parent, child):
+    """Push item (rule, dot, start) with the given tip, unless it is already in
+    the column; then keep the better tip, preferring the new one on ties.
+    Returns (size, row, state) where state is 0 for a new item, 1 if an old
+    item's tip was replaced and 2 if it was kept."""
+    if key in index:
+        row = index[key]
+        if weight <= weights[row]:
+            weights[row] = weight
+            rows[row, PARENT] = parent
+            rows[row, CHILD] = child
+            return size, row, 1
+        return size, row, 2
+    rows[size, RULE] = rule
+    rows[size, DOT] = dot
+    rows[size, START] = start
+    rows[size, PARENT] = parent
+    rows[size, CHILD] = child
+    weights[size] = weight
+    index[key] = size
+    return size + 1, size, 0
+
+
+@njit(cache=True)
+def _requeue(reprocess, tail, queued, row, size):
+    """Queue a popped row whose tip improved to be popped again, unless it
+    already is (it will be processed with its new tip then anyway).
+    Returns the possibly grown (reprocess, tail, queued)."""
+    if row >= queued.shape[0]:
+        flags = np.zeros(max(2 * queued.shape[0], size), np.uint8)
+        flags[:queued.shape[0]] = queued
+        queued = flags
+    if queued[row]:
+        return reprocess, tail, queued
+    queued[row] = 1
+    if tail == reprocess.shape[0]:
+        grown = np.empty(2 * tail, np.int64)
+        grown[:tail] = reprocess
+        reprocess = grown
+    reprocess[tail] = row
+    return reprocess, tail + 1, queued
+
+
+@njit(cache=True)
+def _leo_top(rows, weights, rhs_off, rule_lhs, waiting, wait_range, num_symbols, start_symbol,
+             c, column, weight):
+    """Follow the chain of deterministic attachments that starts with customer
+    row c in the given column, as EarleyChart._leo_item does in parse.py.
+    `weight` is that of the complete item being attached.  Returns (top,
+    top_column, weight): the row and column of the customer at the top of the
+    chain and the weight of the item it leads to, summed in the same order as
+    attaching step by step; top is -1 if there is no chain."""
+    top = np.int64(-1)
+    top_column = np.int64(-1)
+    while True:
+        rule = np.int64(rows[c, RULE])
+        if rows[c, DOT] != rhs_off[rule + 1] - rhs_off[rule] - 1:
+            break  # the symbol c waits for is not its last one
+        weight = weights[c] + weight
+        top = c
+        top_column = column
+        column = np.int64(rows[c, START])
+        nonterminal = np.int64(rule_lhs[rule])
+        if nonterminal == start_symbol and column == 0:
+            break  # never skip over a complete start symbol from position 0
+        key = column * num_symbols + nonterminal
+        if key not in wait_range:
+            break
+        packed = wait_range[key]
+        if (packed & 0xFFFFFFFF) - (packed >> 32) != 1:
+            break
+        c = waiting[packed >> 32]
+    return top, top_column, weight
+
+
+@njit(cache=True)
+def _earley(rule_lhs, rhs_off, rhs_flat, rule_weight, is_nt, exp_off, exp_flat,
+            lc_row, left_corner, start_symbol, tokens):
+    n = tokens.shape[0]
+    num_symbols = is_nt.shape[0]
+    rows = np.empty((1024, 5), ROW_DTYPE)
+    weights = np.empty(1024, np.float64)
+    size = np.int64(0)  # not the literal 0, so that _offer is compiled just once
+    col_off = np.zeros(n + 2, np.int64)
+
+    # Duplicate detection for the column being filled, keyed by packed item.
+    index = Dict.empty(key_type=types.int64, value_type=types.int64)
+    # Customers of finished columns: rows waiting for nonterminal A in column i are
+    # waiting[b:e], where wait_range[i * num_symbols + A] == (b << 32) | e.
+    waiting = np.empty(1024, np.int64)
+    num_waiting = 0
+    wait_range = Dict.empty(key_type=types.int64, value_type=types.int64)
+    # Popped rows whose tip improved and must be popped again, first in first out.
+    reprocess = np.empty(64, np.int64)
+    queued = np.zeros(1024, np.uint8)  # queued[g] says whether row g is in reprocess already
+    # predicted[A] == i if A was already predicted in column i
+    predicted = np.full(num_symbols, -1, np.int64)
+
+    for i in range(n + 1):
+        begin = col_off[i]
+        lookahead = tokens[i] if i < n else -2  # -1 is an unknown word, -2 the end of the sentence
+        if i == 0:
+            pending = start_symbol  # start looking for ROOT at position 0
+        else:
+            pending = -1
+        next = begin
+        head = 0
+        tail = 0
+        while True:
+            if pending >= 0:
+                g = -1
+                symbol = pending
+                pending = -1
+            else:
+                if head < tail:
+                    g = reprocess[head]
+                    head += 1
+                    queued[g] = 0
+                elif next < size:
+                    g = next
+                    next += 1
+                else:
+                    break
+                rule = np.int64(rows[g, RULE])
+                dot = np.int64(rows[g, DOT])
+                if dot == rhs_off[rule + 1] - rhs_off[rule]:
+                    # Attach this complete constituent to its customers
+                    mid = np.int64(rows[g, START])
+                    key = mid * num_symbols + rule_lhs[rule]
+                    if key not in wait_range:
+                        continue
+                    packed = wait_range[key]
+                    b = packed >> 32
+                    e = packed & 0xFFFFFFFF
+                    rows, weights = _reserve(rows, weights, size + e - b)
+                    top, top_column, weight = np.int64(-1), np.int64(-1), 0.0
+                    if e - b == 1:
+                        top, top_column, weight = _leo_top(rows, weights, rhs_off, rule_lhs, waiting, wait_range,
+                                                           num_symbols, start_symbol, waiting[b], mid, weights[g])
+                    if top >= 0:
+                        # Jump straight to the top of a chain of deterministic attachments
+                        c_rule = np.int64(rows[top, RULE])
+                        c_dot = np.int64(rows[top, DOT]) + 1
+                        c_start = np.int64(rows[top, START])
+                        key = (c_rule << RULE_SHIFT) | (c_dot << DOT_SHIFT) | c_start
+                        size, row, state = _offer(rows, weights, size, index, key, c_rule, c_dot, c_start,
+                                                  weight, np.int64(top - col_off[top_column]),
+                                                  np.int64(LEO_CHILD - (g - begin)))
+                        if state == 1 and row < next:
+                            reprocess, tail, queued = _requeue(reprocess, tail, queued, row, size)
+                        continue
+                    for k in range(b, e):
+                        c = waiting[k]
+                        c_rule = np.int64(rows[c, RULE])
+                        c_dot = np.int64(rows[c, DOT]) + 1
+                        c_start = np.int64(rows[c, START])
+                        key = (c_rule << RULE_SHIFT) | (c_dot << DOT_SHIFT) | c_start
+                        size, row, state = _offer(rows, weights, size, index, key, c_rule, c_dot, c_start,
+                                                  weights[c] + weights[g], np.int64(c - col_off[mid]),
+                                                  np.int64(g - begin))
+                        if state == 1 and row < next:
+                            reprocess, tail, queued = _requeue(reprocess, tail, queued, row, size)
+                    continue
+                symbol = rhs_flat[rhs_off[rule] + dot]
+                if not is_nt[symbol]:
+                    continue  # terminals are scanned once the column is finished
+            # Predict the nonterminal after the dot
+            if predicted[symbol] == i:
+                continue
+            predicted[symbol] = i
+            rows, weights = _reserve(rows, weights, size + exp_off[symbol + 1] - exp_off[symbol])
+            for k in range(exp_off[symbol], exp_off[symbol + 1]):
+                r = exp_flat[k]
+                if lookahead != -2:  # skip rules that can't begin with the next word (no rule is nullable here)
+                    first = rhs_flat[rhs_off[r]]
+                    if is_nt[first]:
+                        if lookahead < 0 or not left_corner[lc_row[first], lookahead]:
+                            continue
+                    elif first != lookahead:
+                        continue
+                key = (r << RULE_SHIFT) | i
+                size, row, state = _offer(rows, weights, size, index, key, np.int64(r), np.int64(0), np.int64(i),
+                                          rule_weight[r], np.int64(NO_ROW), np.int64(NO_ROW))
+
+        # The column is finished.  Index its customers by the nonterminal they wait for.
+        end = size
+        col_off[i + 1] = end
+        index.clear()
+        count = 0
+        symbols = np.empty(end - begin, np.int64)
+        candidates = np.empty(end - begin, np.int64)
+        for g in range(begin, end):
+            rule = rows[g, RULE]
+            dot = rows[g, DOT]
+            if dot < rhs_off[rule + 1] - rhs_off[rule] and is_nt[rhs_flat[rhs_off[rule] + dot]]:
+                symbols[count] = rhs_flat[rhs_off[rule] + dot]
+                candidates[count] = g
+                count += 1
+        order = np.argsort(symbols[:count], kind="mergesort")  # stable, so rows stay in push order
+        if num_waiting + count > waiting.shape[0]:
+            grown = np.empty(max(2 * waiting.shape[0], num_waiting + count), np.int64)
+            grown[:num_waiting] = waiting[:num_waiting]
+            waiting = grown
+        k = 0
+        while k < count:
+            symbol = symbols[order[k]]
+            b = num_waiting
+            while k < count and symbols[order[k]] == symbol:
+                waiting[num_waiting] = candidates[order[k]]
+                num_waiting += 1
+                k += 1
+            wait_range[i * num_symbols + symbol] = (b << 32) | num_waiting
+
+        # Scan the next word into the next column.
+        if i == n:
+            break
+        rows, weights = _reserve(rows, weights, size + end - begin)
+        for g in range(begin, end):
+            rule = np.int64(rows[g, RULE])
+            dot = np.int64(rows[g, DOT])
+            if (dot < rhs_off[rule + 1] - rhs_off[rule] and rhs_flat[rhs_off[rule] + dot] == tokens[i]
+                    and not is_nt[tokens[i]]):
+                key = (rule << RULE_SHIFT) | ((dot + 1) << DOT_SHIFT) | np.int64(rows[g, START])
+                size, row, state = _offer(rows, weights, size, index, key, rule, dot + 1, np.int64(rows[g, START]),
+                                          weights[g], np.int64(g - begin), np.int64(NO_ROW))
+
+    return col_off, rows[:size], weights[:size]
@@ -11,17 +11,34 @@ that reconstructs the highest-probability parse of each given sentence.)
 from __future__ import annotations
 import argparse
 import logging
+from array import array
 import math
 import tqdm
 from dataclasses import dataclass
 from pathlib import Path
-from collections import Counter
-from typing import Counter as CounterType, Iterable, List, Optional, Dict, Tuple, Union, final
+from collections import Counter, OrderedDict, deque
+from typing import Counter as CounterType, Deque, FrozenSet, Iterable, List, NamedTuple, Optional, Dict, Set, Tuple, Union, final
 
 from sympy.logic.boolalg import Boolean
 
 log = logging.getLogger(Path(__file__).stem)  # For usage, see findsim.py in earlier assignment.
 
+earley_numba = None  # compiled version of the Earley loop; imported by load_earley_numba() if asked for
+
+
+def load_earley_numba() -> bool:
+    """Import the earley_numba module, unless we already have.  Returns
+    whether it is available (it needs numba).  This is done only on
+    request, since importing numba takes longer than parsing small files."""
+    global earley_numba
+    if earley_numba is None:
+        try:
+            import earley_numba as module
+        except ImportError:
+            return False
+        earley_numba = module
+    return True
+
 
 def parse_args() -> argparse.Namespace:
     """Parse command-line arguments"""
@@ -47,6 +64,13 @@ def parse_args() -> argparse.Namespace:
         default=False,
     )
 
+    parser.add_argument(
+        "--numba",
+        action="store_true",
+        help="Use the compiled parser in earley_numba (needs numba; pays off on big grammars like wallstreet.gr)",
+        default=False,
+    )
+
     # for verbosity of logging
     parser.set_defaults(logging_level=logging.INFO)
     verbosity = parser.add_mutually_exclusive_group()
@@ -63,36 +87,57 @@ def parse_args() -> argparse.Namespace:
 class EarleyChart:
     """A chart for Earley's algorithm."""
 
-    def __init__(self, tokens: List[str], grammar: Grammar, progress: bool = False) -> None:
+    def __init__(self, tokens: List[str], grammar: Grammar, progress: bool = False,
+                 use_numba: bool = False) -> None:
         """Create the chart based on parsing `tokens` with `grammar`.
-        `progress` says whether to display progress bars as we parse."""
+        `progress` says whether to display progress bars as we parse.
+        `use_numba` says whether to run the compiled parser in earley_numba,
+        if numba is installed; it builds the same chart, but has no progress
+        bars or debug logging."""
         self.tokens = tokens
         self.grammar = grammar
+        assert grammar.finalized
+        self.token_ids = [grammar.symbol_id(token) for token in tokens]  # -1 for words the grammar lacks
+        if len(tokens) > START_MASK:
+            raise ValueError(f"Can't parse sentences longer than {START_MASK} words")
         self.progress = progress
         self.profile: CounterType[str] = Counter()
         self.cols: List[Agenda]
-        self._run_earley()  # run Earley's algorithm to construct self.cols
+        if use_numba and grammar.numba_arrays() is not None:
+            self._run_earley_compiled()
+        else:
+            self._run_earley()  # run Earley's algorithm to construct self.cols
 
     def accepted_with_item(self) -> Union[None, Item]:
         """Was the sentence accepted?
         That is, does the finished chart contain an item corresponding to a parse of the sentence?
         This method answers the recognition question, but not the parsing question."""
         final_item = None
+        start_id = self.grammar.symbol_id(self.grammar.start_symbol)
         for item in self.cols[-1].all():  # the last column
-            if (item.rule.lhs == self.grammar.start_symbol  # a ROOT item in this column
-                    and item.next_symbol() is None  # that is complete
-                    and item.start_position == 0):  # and started back at position 0
+            rule_id, _, start_position = unpack_item(item)
+            if (self.grammar.rule_lhs[rule_id] == start_id  # a ROOT item in this column
+                    and self.grammar.next_symbol(item) is None  # that is complete
+                    and start_position == 0):  # and started back at position 0
                 final_item = item
                 break
         return final_item
 
     def _run_earley(self) -> None:
         """Fill in the Earley chart."""
-        # Initially empty column for each position in sentence
-        self.cols = [Agenda() for _ in range(len(self.tokens) + 1)]
-
-        # Start looking for ROOT at position 0
-        self._predict(self.grammar.start_symbol, 0)
+        # Initially empty column for each position in sentence, except that
+        # we reuse the finished columns of the longest prefix parsed before
+        # (but not when logging every step, so that the log shows them all)
+        verbose = log.isEnabledFor(logging.DEBUG)
+        reused = () if verbose else self.grammar.prefix_charts.lookup(self.tokens)
+        self.cols = list(reused) + [Agenda(self.grammar) for _ in range(len(self.tokens) + 1 - len(reused))]
+
+        if reused:
+            # Pick up where that parse was: scan its last word into the first new column
+            self._scan(len(reused) - 1)
+        else:
+            # Start looking for ROOT at position 0
+            self._predict(self.grammar.symbol_id(self.grammar.start_symbol), 0)
 
         # We'll go column by column, and within each column row by row.
         # Processing earlier entries in the column may extend the column
@@ -100,61 +145,157 @@ class EarleyChart:
         #
         # The iterator over numbered columns is `enumerate(self.cols)`.
         # Wrapping this iterator in the `tqdm` call provides a progress bar.
-        for i, column in tqdm.tqdm(enumerate(self.cols),
+        #
+        # What to do with an item depends only on its rule and dot position,
+        # so we look that up in the grammar's precomputed tables.
+        #
+        # Unless we are logging every step, predict and attach are done
+        # right here in the loop (see _process_column) instead of by calling
+        # _predict and _attach, which saves a lot of method calls and
+        # attribute lookups per item.
+        next_sym = self.grammar.next_sym
+        next_kind = self.grammar.next_kind
+        for i, column in tqdm.tqdm(enumerate(self.cols[len(reused):], start=len(reused)),
                                    total=len(self.cols),
+                                   initial=len(reused),
                                    disable=not self.progress):
+            if not verbose:
+                self._process_column(i)
+                self._scan(i)
+                continue
             log.debug("")
             log.debug(f"Processing items in column {i}")
             while column:  # while agenda isn't empty
                 item = column.pop()  # dequeue the next unprocessed item
-                next = item.next_symbol()
-                if next is None:
+                rule_id = item >> RULE_SHIFT
+                dot_position = (item >> DOT_SHIFT) & DOT_MASK
+                kind = next_kind[rule_id][dot_position]
+                if kind == COMPLETE:
                     # Attach this complete constituent to its customers
-                    log.debug(f"{item} => ATTACH")
+                    log.debug(f"{self.grammar.item_repr(item)} => ATTACH")
                     self._attach(item, i)
-                elif self.grammar.is_nonterminal(next):
+                elif kind == NONTERMINAL:
                     # Predict the nonterminal after the dot
-                    log.debug(f"{item} => PREDICT")
-                    self._predict(next, i)
+                    log.debug(f"{self.grammar.item_repr(item)} => PREDICT")
+                    self._predict(next_sym[rule_id][dot_position], i)
                 else:
-                    # Try to scan the terminal after the dot
-                    log.debug(f"{item} => SCAN")
-                    self._scan(item, i)
-
-    def _predict(self, nonterminal: str, position: int) -> None:
+                    # The terminal after the dot is scanned below, once the
+                    # column is finished and this item's tip can no longer change
+                    log.debug(f"{self.grammar.item_repr(item)} => SCAN")
+            self._scan(i)
+        if not verbose:
+            self.grammar.prefix_charts.store(self.tokens, self.cols)
+
+    def _process_column(self, position: int) -> None:
+        """Pop and process every item in the given column, like the loop in
+        _run_earley, but with _predict and _attach inlined.  Everything
+        used per item is bound to a local variable first."""
+        cols = self.cols
+        column = cols[position]
+        pop = column.pop
+        push = column.push
+        update_tip_for_item = column.update_tip_for_item
+        move_down_item = column.move_down_item
+        row_of = column.row_of
+        weights = column.weights
+        next_sym = self.grammar.next_sym
+        next_kind = self.grammar.next_kind
+        rule_lhs = self.grammar.rule_lhs
+        rule_weight = self.grammar.rule_weight
+        leo_item = self._leo_item
+        leo_attach = self._leo_attach
+        lookahead = self.token_ids[position] if position < len(self.token_ids) else None
+        predictions = self.grammar.predictions_for(lookahead)
+        predicted = attached = 0
+        predicted_symbols: Set[int] = set()  # nonterminals already predicted in this column
+        while column:  # while agenda isn't empty
+            item = pop()  # dequeue the next unprocessed item
+            rule_id = item >> RULE_SHIFT
+            dot_position = (item >> DOT_SHIFT) & DOT_MASK
+            kind = next_kind[rule_id][dot_position]
+            if kind == COMPLETE:
+                # Attach this complete constituent to its customers (as in _attach)
+                mid = item & START_MASK
+                row = row_of(item)
+                leo = leo_item(mid, rule_lhs[rule_id]) if mid < position else None  # column mid must be finished
+                if leo is not None:
+                    # Jump straight to the top of a chain of deterministic attachments
+                    leo_attach(column, leo, row)
+                    attached += 1
+                    continue
+                customers = cols[mid]
+                customer_items = customers.all()
+                customer_weights = customers.weights
+                for customer_row in customers.customers(rule_lhs[rule_id]):
+                    new_item = customer_items[customer_row] + DOT_ONE
+                    if_old_item_exists = push(new_item)
+                    weight = customer_weights[customer_row] + weights[row]
+                    if_old_item_with_worse_weight = update_tip_for_item(new_item, weight, customer_row, row)
+                    if if_old_item_exists and if_old_item_with_worse_weight:
+                        move_down_item(new_item)
+                    attached += 1
+            elif kind == NONTERMINAL:
+                # Predict the nonterminal after the dot (as in _predict), unless we
+                # already did: that would push the very same items with the same weights
+                nonterminal = next_sym[rule_id][dot_position]
+                if nonterminal in predicted_symbols:
+                    continue
+                predicted_symbols.add(nonterminal)
+                for new_rule_id in predictions[nonterminal]:
+                    new_item = (new_rule_id << RULE_SHIFT) | position
+                    push(new_item)
+                    update_tip_for_item(new_item, rule_weight[new_rule_id], NO_ROW, NO_ROW)
+                    predicted += 1
+            # Terminals are scanned by _scan once the column is finished
+        self.profile["PREDICT"] += predicted
+        self.profile["ATTACH"] += attached
+
+    def _run_earley_compiled(self) -> None:
+        """Fill in the Earley chart using earley_numba, and wrap each of
+        its columns so that it looks like a finished Agenda."""
+        col_off, rows, weights = earley_numba.run_earley(
+            self.grammar.numba_arrays(), self.grammar.symbol_id(self.grammar.start_symbol), self.token_ids)
+        self.cols = [FinishedColumn(self.grammar, rows[col_off[i]:col_off[i + 1]], weights[col_off[i]:col_off[i + 1]])
+                     for i in range(len(self.tokens) + 1)]
+
+    def _predict(self, nonterminal: int, position: int) -> None:
         """Start looking for this nonterminal at the given position.
 
+        Rules that cannot start with the next word are not predicted at all,
+        since their items could never get past the dot (see Grammar.predictions).
+
         For predict, we <don't> need to consider move-down!!! (See B-2 Reprocessing for what is move-down)
         """
-        for rule in self.grammar.expansions(nonterminal):
-            new_item = Item(rule, dot_position=0, start_position=position)
+        lookahead = self.token_ids[position] if position < len(self.token_ids) else None
+        for rule_id in self.grammar.predictions(nonterminal, lookahead):
+            new_item = pack_item(rule_id, 0, position)
             self.cols[position].push(new_item)
+            self.cols[position].update_tip_for_item(new_item, self.grammar.rule_weight[rule_id], NO_ROW, NO_ROW)
 
-            new_tip = Tip(new_item)
-            new_tip.initialize_when_predict()
-            self.cols[position].update_tip_for_item(new_item, new_tip)
-
-            log.debug(f"\tPredicted: {new_item} in column {position}")
+            log.debug(f"\tPredicted: {self.grammar.item_repr(new_item)} in column {position}")
             self.profile["PREDICT"] += 1
 
-    def _scan(self, item: Item, position: int) -> None:
-        """Attach the next word to this item that ends at position,
-        if it matches what this item is looking for next.
+    def _scan(self, position: int) -> None:
+        """Attach the next word to every item that ends at position
+        and is looking for that word next.
 
-        We call the "item" argument of this function the scanned item
+        We call each such item a scanned item.  Only the items waiting for
+        this very word are visited, thanks to the column's scan candidates.
 
         For scan, we <don't> need to consider move-down!!!!! (See B-2 Reprocessing for what is move-down)
         """
-        if position < len(self.tokens) and self.tokens[position] == item.next_symbol():
-            new_item = item.with_dot_advanced()
+        if position == len(self.tokens):
+            return
+        column = self.cols[position]
+        verbose = log.isEnabledFor(logging.DEBUG)  # so the f-string below isn't built for nothing
+        for row in column.scan_candidates(self.token_ids[position]):
+            new_item = self.grammar.with_dot_advanced(column.all()[row])
             self.cols[position + 1].push(new_item)
+            # The backpointer for a terminal is just NO_ROW
+            self.cols[position + 1].update_tip_for_item(new_item, column.weights[row], row, NO_ROW)
 
-            new_tip = Tip(new_item)
-            tip_of_scanned_item = self.cols[position].find_tip_for_item(item)
-            new_tip.initialize_when_scan(tip_of_scanned_item)
-            self.cols[position + 1].update_tip_for_item(new_item, new_tip)
-
-            log.debug(f"\tScanned to get: {new_item} in column {position + 1}")
+            if verbose:
+                log.debug(f"\tScanned to get: {self.grammar.item_repr(new_item)} in column {position + 1}")
             self.profile["SCAN"] += 1
 
     def _attach(self, item: Item, position: int) -> None:
@@ -165,52 +306,169 @@ class EarleyChart:
         We call the "item" argument of this function the attachment item or the attached item.
         Note that we also have a customer item
 
+        If the attachment is the first of a chain of deterministic ones (see
+        _leo_item), we skip the chain and build only the item at its top.
+
         For attach, we <do> need to consider move-down!!! (See B-2 Reprocessing for what is move-down)
         """
-        mid = item.start_position  # start position of this item = end position of item to its left
-        for customer in self.cols[mid].all():  # could you eliminate this inefficient linear search?
-            if customer.next_symbol() == item.rule.lhs:
-                new_item = customer.with_dot_advanced()
-                if_old_item_exists = self.cols[position].push(new_item)
-
-                new_tip = Tip(new_item)
-                tip_of_attachment_item = self.cols[position].find_tip_for_item(item)
-                tip_of_customer_item = self.cols[mid].find_tip_for_item(customer)
-                new_tip.initialize_when_attach(tip_of_attachment_item, tip_of_customer_item, position)
-                if_old_item_with_worse_weight = self.cols[position].update_tip_for_item(new_item, new_tip)
-
-                if if_old_item_exists and if_old_item_with_worse_weight:
-                    self.cols[position].move_down_item(new_item)
-
-                log.debug(f"\tAttached to get: {new_item} in column {position}")
-                self.profile["ATTACH"] += 1
-
-    def find_tip_for_item_globally(self, item: Item, postion: Optional[int] = None) -> Tip:
+        mid = item & START_MASK  # start position of this item = end position of item to its left
+        column = self.cols[position]
+        customers = self.cols[mid]
+        row = column.row_of(item)
+        leo = self._leo_item(mid, self.grammar.rule_lhs[item >> RULE_SHIFT]) if mid < position else None
+        if leo is not None:
+            new_item = self._leo_attach(column, leo, row)
+            log.debug(f"\tAttached through a Leo chain to get: {self.grammar.item_repr(new_item)} in column {position}")
+            self.profile["ATTACH"] += 1
+            return
+        for customer_row in customers.customers(self.grammar.rule_lhs[item >> RULE_SHIFT]):  # only items waiting for this lhs
+            new_item = self.grammar.with_dot_advanced(customers.all()[customer_row])
+            if_old_item_exists = column.push(new_item)
+
+            # The backpointer for a non-terminal is the complete item that was attached
+            weight = customers.weights[customer_row] + column.weights[row]
+            if_old_item_with_worse_weight = column.update_tip_for_item(new_item, weight, customer_row, row)
+
+            if if_old_item_exists and if_old_item_with_worse_weight:
+                column.move_down_item(new_item)
+
+            log.debug(f"\tAttached to get: {self.grammar.item_repr(new_item)} in column {position}")
+            self.profile["ATTACH"] += 1
+
+    def _leo_attach(self, column: Agenda, leo: LeoChain, row: int) -> Item:
+        """Attach the complete item in the given row of column to the bottom of
+        a Leo chain (see _leo_item), building just the item at its top.
+        Returns that item."""
+        top_position, top_row, chain_weights = leo
+        new_item = self.cols[top_position].all()[top_row] + DOT_ONE
+        if_old_item_exists = column.push(new_item)
+        # Add up the weights in the same order as attaching step by step would,
+        # so that they round the same way.  (Ties between parses may still be
+        # settled differently, since they're settled here at the top of the
+        # chain rather than at each item along it; earley_numba does the same.)
+        weight = column.weights[row]
+        for customer_weight in chain_weights:
+            weight = customer_weight + weight
+        # The backpointer for the chain is its bottom, i.e., the complete item that was attached
+        if_old_item_with_worse_weight = column.update_tip_for_item(new_item, weight, top_row, LEO_CHILD - row)
+        if if_old_item_exists and if_old_item_with_worse_weight:
+            column.move_down_item(new_item)
+        return new_item
+
+    def _leo_item(self, position: int, nonterminal: int) -> Optional[LeoChain]:
+        """Leo's optimization for right recursion.  Suppose that a finished
+        column has just one customer waiting for `nonterminal`, and that this
+        is the last symbol of its rule, as in (k, B → β · A).  Then every
+        complete A that starts here leads to exactly one new item, the
+        complete (k, B → β A ·).  That in turn may have just one customer
+        back in column k, and so on.  So we can skip straight to the top of
+        such a chain of deterministic attachments.
+
+        Returns None if there is no chain.  Otherwise it returns the column
+        and row of the customer at the top of the chain, plus the weights of
+        all the customers along the chain from the bottom up.  The answers
+        are memoized in each column's `leo` dict.  We never skip over a
+        complete start symbol from position 0, since accepted_with_item has
+        to find it."""
+        start_symbol = self.grammar.symbol_id(self.grammar.start_symbol)
+        links = []  # (position, nonterminal, customer row) of chain links not memoized yet
+        top: Optional[LeoChain] = None
+        while True:
+            column = self.cols[position]
+            if nonterminal in column.leo:
+                top = column.leo[nonterminal]
+                break
+            customers = column.customers(nonterminal)
+            if len(customers) != 1:
+                column.leo[nonterminal] = None
+                break
+            customer = column.all()[customers[0]]
+            rule_id = customer >> RULE_SHIFT
+            if (customer >> DOT_SHIFT) & DOT_MASK != len(self.grammar.rule_rhs[rule_id]) - 1:
+                column.leo[nonterminal] = None  # nonterminal is not the last symbol of the customer
+                break
+            links.append((position, nonterminal, customers[0]))
+            position, nonterminal = customer & START_MASK, self.grammar.rule_lhs[rule_id]
+            if nonterminal == start_symbol and position == 0:
+                break
+        for position, nonterminal, row in reversed(links):
+            weight = self.cols[position].weights[row]
+            top = (position, row, (weight,)) if top is None else (top[0], top[1], (weight,) + top[2])
+            self.cols[position].leo[nonterminal] = top
+        return top
+
+    def find_tip_for_item_globally(self, item: Item, postion: Optional[int] = None) -> Tuple[int, int]:
+        """Find the column and row of item.  If no column is given, use the last one that has it."""
         if postion is not None:
             agenda = self.cols[postion]
-            if item in agenda.all():
-                return agenda.find_tip_for_item(item)
+            if item in agenda:
+                return postion, agenda.row_of(item)
         else:
-            for i, agenda in enumerate(self.cols[::-1]):
-                if item in agenda.all():
-                    return agenda.find_tip_for_item(item)
+            for i in reversed(range(len(self.cols))):
+                agenda = self.cols[i]
+                if item in agenda:
+                    return i, agenda.row_of(item)
         raise ValueError
 
+    def backpointers(self, position: int, row: int) -> List[Backpointer]:
+        """The backpointers of the item in the given column and row, one per symbol before the dot.
+        We follow the chain of parents, i.e., the same rule with the dot one step further left."""
+        result: List[Backpointer] = []
+        while True:
+            agenda = self.cols[position]
+            if (agenda.all()[row] >> DOT_SHIFT) & DOT_MASK == 0:
+                break
+            child = agenda.bp_child[row]
+            if child == NO_ROW:  # a scanned terminal; the parent ends one word back
+                result.append(None)
+                parent_position = position - 1
+            elif child >= 0:  # an attached nonterminal; the parent ends where the child starts
+                child_item = agenda.all()[child]
+                result.append((child_item, position))
+                parent_position = child_item & START_MASK
+            else:  # the top of a Leo chain; rebuild the skipped items from its bottom up
+                bp: Backpointer = (agenda.all()[LEO_CHILD - child], position)
+                parent_position, top_row = self._leo_item(bp[0] & START_MASK, self.grammar.rule_lhs[bp[0] >> RULE_SHIFT])[:2]
+                link_position = bp[0] & START_MASK
+                link_row = self.cols[link_position].customers(self.grammar.rule_lhs[bp[0] >> RULE_SHIFT])[0]
+                while (link_position, link_row) != (parent_position, top_row):
+                    bp = LeoStep(link_position, link_row, bp)
+                    customer = self.cols[link_position].all()[link_row]
+                    link_position = customer & START_MASK
+                    link_row = self.cols[link_position].customers(self.grammar.rule_lhs[customer >> RULE_SHIFT])[0]
+                result.append(bp)
+            row = agenda.bp_parent[row]
+            position = parent_position
+        result.reverse()
+        return result
+
     def pretty_print_item(self, item: Item, position: Optional[int] = None) -> str:
-        tip = self.find_tip_for_item_globally(item, position)
-        assert item.dot_position == len(item.rule.rhs) == len(tip.backpointers)
-        lhs = item.rule.lhs
+        position, row = self.find_tip_for_item_globally(item, position)
+        return self._pretty_print(item, self.backpointers(position, row))
+
+    def _pretty_print(self, item: Item, backpointers: List[Backpointer]) -> str:
+        rule_id, dot_position, _ = unpack_item(item)
+        rhs = self.grammar.rule_rhs[rule_id]
+        assert dot_position == len(rhs) == len(backpointers)
+        lhs = self.grammar.symbol(self.grammar.rule_lhs[rule_id])
         result = "(" + f" {lhs}"
-        for i in range(len(item.rule.rhs)):
-            symbol = item.rule.rhs[i]
-            if not self.grammar.is_nonterminal(symbol):
+        for i in range(len(rhs)):
+            symbol = rhs[i]
+            if not self.grammar.is_nt[symbol]:
                 # Terminal
-                result += f" {symbol}"
+                result += f" {self.grammar.symbol(symbol)}"
             else:
                 # Nonterminal, print recursively
-                item_for_symbol, pos = tip.backpointers[i]
-                assert item_for_symbol.rule.lhs == symbol
-                result += f" {self.pretty_print_item(item_for_symbol, pos)}"
+                bp = backpointers[i]
+                if isinstance(bp, LeoStep):  # an item skipped by Leo's optimization
+                    item_for_symbol = self.cols[bp.position].all()[bp.row] + DOT_ONE
+                    assert self.grammar.rule_lhs[item_for_symbol >> RULE_SHIFT] == symbol
+                    result += f" {self._pretty_print(item_for_symbol, self.backpointers(bp.position, bp.row) + [bp.child])}"
+                    continue
+                item_for_symbol, pos = bp
+                assert self.grammar.rule_lhs[item_for_symbol >> RULE_SHIFT] == symbol
+                row = self.cols[pos].row_of(item_for_symbol)  # no need to search the columns
+                result += f" {self._pretty_print(item_for_symbol, self.backpointers(pos, row))}"
         result += ")"
         return result
 
@@ -245,81 +503,66 @@ class Rule:
         return f"{self.lhs} → {' '.join(self.rhs)}"
 
 # We particularly want items to be immutable, since they will be hashed and
-# used as keys in a dictionary (for duplicate detection).
-@dataclass(frozen=True)
-class Item:
-    """An item in the Earley parse chart, representing one or more subtrees
-    that could yield a particular substring."""
-    rule: Rule
-    dot_position: int
-    start_position: int
-
-    # We don't store the end_position, which corresponds to the column
-    # that the item is in, although you could store it redundantly for
-    # debugging purposes if you wanted.
-
-    def next_symbol(self) -> Optional[str]:
-        """What's the next, unprocessed symbol (terminal, non-terminal, or None) in this partially matched rule?"""
-        assert 0 <= self.dot_position <= len(self.rule.rhs)
-        if self.dot_position == len(self.rule.rhs):
-            return None
-        else:
-            return self.rule.rhs[self.dot_position]
+# used as keys in a dictionary (for duplicate detection).  An item is just a
+# single int that packs (rule id, dot position, start position) into bit
+# fields, so it is small and hashes to itself; the Grammar knows how to
+# interpret the rule id.
+#
+# We don't store the end_position, which corresponds to the column
+# that the item is in, although you could store it redundantly for
+# debugging purposes if you wanted.
+Item = int
+
+DOT_SHIFT = 16  # the low 16 bits hold the start position
+RULE_SHIFT = 24  # the next 8 bits hold the dot position, and the rest the rule id
+START_MASK = (1 << DOT_SHIFT) - 1
+DOT_ONE = 1 << DOT_SHIFT  # add this to an item to advance its dot
+DOT_MASK = (1 << (RULE_SHIFT - DOT_SHIFT)) - 1
+
+def pack_item(rule_id: int, dot_position: int, start_position: int) -> Item:
+    """
+    The item for a rule with the dot at the given position, started at the given position.
+    >>> item = pack_item(3, 1, 5)
+    >>> unpack_item(item)
+    (3, 1, 5)
+    >>> unpack_item(item + (1 << DOT_SHIFT))  # dot advanced
+    (3, 2, 5)
+    """
+    return (rule_id << RULE_SHIFT) | (dot_position << DOT_SHIFT) | start_position
 
-    def with_dot_advanced(self) -> Item:
-        if self.next_symbol() is None:
-            raise IndexError("Can't advance the dot past the end of the rule")
-        return Item(rule=self.rule, dot_position=self.dot_position + 1, start_position=self.start_position)
+def unpack_item(item: Item) -> Tuple[int, int, int]:
+    """The (rule id, dot position, start position) of an item."""
+    return item >> RULE_SHIFT, (item >> DOT_SHIFT) & DOT_MASK, item & START_MASK
 
-    def __repr__(self) -> str:
-        """Human-readable representation string used when printing this item."""
-        # Note: If you revise this class to change what an Item stores, you'll probably want to change this method too.
-        DOT = "·"
-        rhs = list(self.rule.rhs)  # Make a copy.
-        rhs.insert(self.dot_position, DOT)
-        dotted_rule = f"{self.rule.lhs} → {' '.join(rhs)}"
-        return f"({self.start_position}, {dotted_rule})"  # matches notation on slides
+# What comes right after the dot of an item: see Grammar.next_kind.
+COMPLETE, NONTERMINAL, TERMINAL = 0, 1, 2
 
-Backpointer = Optional[Tuple[Item, int]]
+class LeoStep(NamedTuple):
+    """Backpointer to a complete item that Leo's optimization never built:
+    the customer in the given column and row, with its dot advanced over `child`."""
+    position: int
+    row: int
+    child: Backpointer
 
-class Tip:
-    """
-    We prepare a Tip object for each Item object.
-    For each item, its tip helps to indicate the weight and backpointers for this item.
-    """
-    def __init__(self, item) -> None:
-        self.item: Item = item    # For what item are we initializing this tip?
-        self.weight: Union[int, None] = None
-        self.backpointers: list[Backpointer] = list()
-
-    def initialize_when_predict(self):
-        # In this case, self.item is an item added to agenda by predict
-        self.weight = self.item.rule.weight
-        assert len(self.backpointers) == self.item.dot_position
-
-    def initialize_when_scan(self, tip_of_scanned_item : Tip):
-        # In this case, self.item is an item added to agenda by scan
-        self.weight = tip_of_scanned_item.weight
-        self.backpointers = tip_of_scanned_item.backpointers + [None] # The backpointer for a terminal is just a None
-        assert len(self.backpointers) == self.item.dot_position
-
-    def initialize_when_attach(self, tip_of_attachment_item : Tip, tip_of_customer_item: Tip, position: int):
-        # In this case, self.item is an item added to agenda by attach
-        assert len(tip_of_attachment_item.item.rule.rhs) == tip_of_attachment_item.item.dot_position == len(tip_of_attachment_item.backpointers) # assure that attachment item is complete
-        self.weight = tip_of_customer_item.weight + tip_of_attachment_item.weight
-        self.backpointers = tip_of_customer_item.backpointers + [(tip_of_attachment_item.item, position)] # The backpointer for a non-terminal is a item that is complete
-        assert len(self.backpointers) == self.item.dot_position
-
-def move_down(lst, i):
+# The backpointer for a nonterminal is (complete item, column it ends in);
+# for a terminal it is None.
+Backpointer = Union[None, Tuple[Item, int], LeoStep]
+
+NO_ROW = -1  # a missing backpointer; see Agenda.bp_parent and Agenda.bp_child
+LEO_CHILD = -2  # bp_child = LEO_CHILD - row means a Leo chain from the complete item in that row
+
+# A Leo chain: column and row of the customer at its top, and the weights of its customers from the bottom up
+LeoChain = Tuple[int, int, Tuple[float, ...]]
+
+class Tip(NamedTuple):
     """
-    Move down the i-th element of the lst
-    >>> lst = [5,8,7,2,3,10]
-    >>> move_down(lst,2)
-    [5, 8, 2, 3, 10, 7]
+    For each item, its tip indicates the weight and backpointers for this item.
+    The Agenda stores tips column-wise (see Agenda.weights); this is just a
+    read-only view of one row.
     """
-    assert i<len(lst)
-    new_lst = lst[:i] + lst[i+1:] + [lst[i]]
-    return new_lst
+    weight: float
+    parent: int  # row of the same rule with the dot one step to the left, or NO_ROW if the dot is at 0
+    child: int   # row (in this column) of the complete item attached last, or NO_ROW
 
 class Agenda:
     """An agenda of items that need to be processed.  Newly built items
@@ -344,37 +587,73 @@ class Agenda:
     However, other implementations are possible -- and could be useful
     when dealing with weights, backpointers, and optimizations.
 
+    Every pushed item gets a row number, its position in `all()`.  The tips
+    are stored as parallel arrays indexed by row rather than as one object
+    per item: `weights[row]` is the best weight found so far, while
+    `bp_parent[row]` and `bp_child[row]` are the backpointers that achieve
+    it.  The parent is the row of the same rule with the dot one step to the
+    left (in the column where the last symbol before the dot starts), and
+    the child is the row in this column of the complete item that was
+    attached to it, or NO_ROW if that symbol was a scanned terminal.  (If
+    the item was built by Leo's optimization, the child is LEO_CHILD - row
+    of the complete item at the bottom of the chain, and the parent is in
+    the column at the top; see EarleyChart._leo_item.)
     """
 
-    def __init__(self) -> None:
-        self._items: List[Item] = []  # list of all items that were *ever* pushed
+    def __init__(self, grammar: Grammar) -> None:
+        self._grammar = grammar  # tells us what each item's next symbol is
+        self._items = array("q")  # all items that were *ever* pushed
         self._index: Dict[Item, int] = {}  # stores index of an item if it was ever pushed
-        self._tips: Dict[Item, Tip] = {} # stores the tip of an item if it was ever pushed
+        self.weights = array("d")  # weight of the tip of each row
+        self.bp_parent: List[int] = []  # backpointers of the tip of each row
+        self.bp_child: List[int] = []
+        self._waiting_for: Dict[int, List[int]] = {}  # maps each nonterminal to the rows whose next symbol it is
+        self._scan_candidates: Dict[int, List[int]] = {}  # same, for each terminal
+        self._reprocess: Deque[Item] = deque()  # popped items that got a better tip and must be popped again
+        self._queued: Set[Item] = set()  # the items in self._reprocess, so that none is queued twice
+        self.leo: Dict[int, Optional[LeoChain]] = {}  # memo for EarleyChart._leo_item
         self._next = 0  # index of first item that has not yet been popped
 
-        # Note: There are other possible designs.  For example, self._index doesn't really
-        # have to store the index; it could be changed from a dictionary to a set.
-        #
-        # However, we provided this design because there are multiple reasonable ways to extend
-        # this design to store weights and backpointers.  That additional information could be
-        # stored either in self._items or in self._index.
+        # Note: self._index could not simply be a set, since rows address the tip
+        # arrays above.  The open list needs no structure of its own either: it is
+        # the rows of self._items from self._next on, plus self._reprocess.
 
     def __len__(self) -> int:
         """Returns number of items that are still waiting to be popped.
         Enables `len(my_agenda)`."""
-        return len(self._items) - self._next
+        return len(self._items) - self._next + len(self._reprocess)
+
+    def __contains__(self, item: Item) -> bool:
+        """Whether the item was ever pushed.  Enables `item in my_agenda`
+        in O(1) time, unlike `item in my_agenda.all()`."""
+        return item in self._index
 
     def push(self, item: Item) -> bool:
-        """Add (enqueue) the item, unless it was previously added."""
-        if_old_item_exists = item in self._index
-        if item not in self._index:  # O(1) lookup in hash table
-            self._items.append(item)
-            self._index[item] = len(self._items) - 1
-        return if_old_item_exists
+        """Add (enqueue) the item, unless it was previously added.
+        Returns whether it was."""
+        row = len(self._items)
+        if self._index.setdefault(item, row) != row:  # a single O(1) lookup in hash table
+            return True
+        self._items.append(item)
+        self.weights.append(math.inf)  # no tip yet; update_tip_for_item will set it
+        self.bp_parent.append(NO_ROW)
+        self.bp_child.append(NO_ROW)
+        rule_id = item >> RULE_SHIFT
+        dot_position = (item >> DOT_SHIFT) & DOT_MASK
+        kind = self._grammar.next_kind[rule_id][dot_position]
+        if kind == NONTERMINAL:
+            self._waiting_for.setdefault(self._grammar.next_sym[rule_id][dot_position], []).append(row)
+        elif kind == TERMINAL:
+            self._scan_candidates.setdefault(self._grammar.next_sym[rule_id][dot_position], []).append(row)
+        return False
 
     def pop(self) -> Item:
         """Returns one of the items that was waiting to be popped (dequeued).
         Raises IndexError if there are no items waiting."""
+        if self._reprocess:
+            item = self._reprocess.popleft()
+            self._queued.discard(item)
+            return item
         if len(self) == 0:
             raise IndexError
         item = self._items[self._next]
@@ -386,68 +665,188 @@ class Agenda:
         they've already been popped."""
         return self._items
 
+    def row_of(self, item: Item) -> int:
+        """The row of an item that was pushed, i.e., its position in `all()`."""
+        return self._index[item]
+
+    def customers(self, symbol: int) -> Iterable[int]:
+        """Rows of all items that have ever been pushed and are
+        waiting for `symbol` right after the dot.  This is what attach
+        needs, without a linear search through `all()`."""
+        return self._waiting_for.get(symbol, ())
+
+    def scan_candidates(self, terminal: int) -> Iterable[int]:
+        """Rows of all items that have ever been pushed and are
+        waiting for `terminal` right after the dot."""
+        return self._scan_candidates.get(terminal, ())
+
     def __repr__(self):
         """Provide a human-readable string REPResentation of this Agenda."""
         next = self._next
-        return f"{self.__class__.__name__}({self._items[:next]}; {self._items[next:]})"
-
-    def update_tip_for_item(self, item: Item, tip: Tip):
-        assert item in self._index
-        if_old_item_with_worse_weight = False
-        if item not in self._tips:
-            self._tips[item] = tip  # Create the tip for existing item
+        popped = [self._grammar.item_repr(item) for item in self._items[:next]]
+        waiting = [self._grammar.item_repr(item) for item in list(self._reprocess) + list(self._items[next:])]
+        return f"{self.__class__.__name__}({popped}; {waiting})"
+
+    def update_tip_for_item(self, item: Item, weight: float, parent: int, child: int) -> bool:
+        """Offer a new tip for a pushed item.  It replaces the old tip unless the old one was
+        strictly better; returns whether the item already had a tip that got replaced."""
+        row = self._index[item]
+        old_weight = self.weights[row]
+        if old_weight == math.inf:  # Create the tip for existing item
+            if_old_item_with_worse_weight = False
+        # This difference will affect permissive.par!!!!!!!!!!!!!!!!!!
+        # elif weight < old_weight:
+        elif weight <= old_weight:
+            if_old_item_with_worse_weight = True # Renew the tip for existing item
         else:
-            old_tip = self._tips[item]
-            # This difference will affect permissive.par!!!!!!!!!!!!!!!!!!
-            # if tip.weight < old_tip.weight:
-            if tip.weight <= old_tip.weight:
-                self._tips[item] = tip # Renew the tip for existing item
-                if_old_item_with_worse_weight = True
-        assert len(self._index) == len(self._items)
+            return False
+        self.weights[row] = weight
+        self.bp_parent[row] = parent
+        self.bp_child[row] = child
         return if_old_item_with_worse_weight
 
     def move_down_item(self, item: Item):
         # ******Move Down an Item For Reprocessing******* See B.2 for what is reprocessing!!
-        # Remember that self._next is the index of first item that has not yet been popped
-        log.debug(f"We are moving down an item {item}")
-        log.debug(f"Before move-down, the index of items are: {self._index}")
-        log.debug(f"Before move-down, the index of first not-popped item is: {self._next}")
+        # Rather than moving the item within self._items (which would renumber
+        # everything after it), we queue it to be popped again; pop() drains
+        # that queue first.  self._items and self._index never change order.
         assert item in self._index
-        if not self._index[item] < self._next: # no need to move down
+        if not self._index[item] < self._next: # not popped yet, so it will be processed with its new tip anyway
+            return
+        if item in self._queued:  # already waiting to be popped again, and will be processed with its new tip then
             return
-        index = self._index[item]
-        move_down(self._items, index)
-        for item_ in self._index:
-            if self._index[item_] > index:
-                self._index[item_] -= 1
-        self._index[item] = len(self._items) - 1
-        self._next -= 1 # We need to move up the pointer!
-        assert len(self._index) == len(self._items)
-        log.debug(f"After move-down, the index of items are: {self._index}")
-        log.debug(f"After move-down, the index of first not-popped item : {self._next}")
+        self._queued.add(item)
+        if log.isEnabledFor(logging.DEBUG):  # this is called from the fast loop too
+            log.debug(f"We are moving down an item {self._grammar.item_repr(item)}")
+        self._reprocess.append(item)
 
     def find_tip_for_item(self, item: Item) -> Tip:
-        assert item in self._tips
-        return self._tips[item]
+        row = self._index[item]
+        return Tip(self.weights[row], self.bp_parent[row], self.bp_child[row])
+
+
 
+class FinishedColumn:
+    """A column of a chart built by earley_numba.  It offers the read-only
+    part of the Agenda interface (there is nothing left to pop), backed by
+    that column's slice of the kernel's arrays."""
+
+    def __init__(self, grammar: Grammar, rows, weights) -> None:
+        self._grammar = grammar
+        self._rows = rows  # one (rule, dot, start, parent, child) row per item
+        self.weights = weights
+        self.bp_parent = rows[:, earley_numba.PARENT]
+        self.bp_child = rows[:, earley_numba.CHILD]
+        self._items: Optional[List[Item]] = None  # built on first use
+        self._index: Optional[Dict[Item, int]] = None
+        self._waiting_for: Optional[Dict[int, List[int]]] = None
+        self.leo: Dict[int, Optional[LeoChain]] = {}  # memo for EarleyChart._leo_item
+
+    def __len__(self) -> int:
+        return 0
+
+    def __contains__(self, item: Item) -> bool:
+        return item in self._row_index()
+
+    def all(self) -> List[Item]:
+        if self._items is None:
+            rows = self._rows.astype("int64")  # so that packing can't overflow
+            self._items = ((rows[:, earley_numba.RULE] << RULE_SHIFT) | (rows[:, earley_numba.DOT] << DOT_SHIFT)
+                           | rows[:, earley_numba.START]).tolist()
+        return self._items
+
+    def row_of(self, item: Item) -> int:
+        return self._row_index()[item]
+
+    def _row_index(self) -> Dict[Item, int]:
+        if self._index is None:
+            self._index = {item: row for row, item in enumerate(self.all())}
+        return self._index
+
+    def customers(self, symbol: int) -> Iterable[int]:
+        """Rows of the items waiting for nonterminal `symbol`, as in Agenda.
+        (Printing needs them to rebuild the items that Leo chains skipped.)"""
+        if self._waiting_for is None:
+            self._waiting_for = {}
+            for row, item in enumerate(self.all()):
+                rule_id, dot_position, _ = unpack_item(item)
+                if self._grammar.next_kind[rule_id][dot_position] == NONTERMINAL:
+                    self._waiting_for.setdefault(self._grammar.next_sym[rule_id][dot_position], []).append(row)
+        return self._waiting_for.get(symbol, ())
+
+    def find_tip_for_item(self, item: Item) -> Tip:
+        row = self.row_of(item)
+        return Tip(float(self.weights[row]), int(self.bp_parent[row]), int(self.bp_child[row]))
 
 
 class Grammar:
-    """Represents a weighted context-free grammar."""
+    """Represents a weighted context-free grammar.
+
+    Symbols and rules are interned as small integer ids, so that the
+    parser only ever hashes and compares ints.  Rule `r` has left-hand
+    side `rule_lhs[r]`, right-hand side `rule_rhs[r]` (a tuple of symbol
+    ids) and weight `rule_weight[r]`; `rules[r]` is the same rule spelled
+    out with strings, for printing.  numba_arrays() gives the same tables
+    as numpy arrays for earley_numba.
+
+    All of the tables below are built by finalize(), which the constructor
+    calls after reading the rules.
+
+    Since rules never change, what follows the dot of an item depends only
+    on its rule and dot position.  `next_sym[r][d]` is that symbol's id
+    (None past the end of the rule) and `next_kind[r][d]` says whether it
+    is COMPLETE, NONTERMINAL or TERMINAL.
+
+    `left_corners[A]` is the set of terminals that can begin a string
+    derived from nonterminal A, and `nullable` the set of nonterminals that
+    can derive the empty string.  The parser uses them (through
+    predictions()) to avoid predicting rules that cannot match the next
+    word."""
 
     def __init__(self, start_symbol: str, *files: Path) -> None:
         """Create a grammar with the given start symbol,
         adding rules from the specified files if any."""
         self.start_symbol = start_symbol
-        self._expansions: Dict[str, List[Rule]] = {}  # maps each LHS to the list of rules that expand it
+        self._sym2id: Dict[str, int] = {}  # maps each symbol to its id
+        self._id2sym: List[str] = []  # maps each id back to its symbol
+        self.is_nt: List[bool] = []  # is_nt[id] says whether that symbol is a nonterminal
+        self.rules: List[Rule] = []
+        self.rule_lhs: List[int] = []
+        self.rule_rhs: List[Tuple[int, ...]] = []
+        self.rule_weight: List[float] = []
+        self.next_sym: List[List[Optional[int]]] = []
+        self.next_kind: List[List[int]] = []
+        self.left_corners: Dict[int, FrozenSet[int]] = {}
+        self.nullable: Set[int] = set()
+        self._predictions: Dict[Optional[int], PredictionTable] = {}  # memo for predictions(), by lookahead
+        self._arrays: Optional[earley_numba.GrammarArrays] = None  # built by numba_arrays() if needed
+        self._dotted_rules: Dict[int, Tuple[str, ...]] = {}  # memo for item_repr()
+        self._expansions: Dict[int, List[int]] = {}  # maps each LHS id to the ids of the rules that expand it
+        self.prefix_charts = PrefixCharts()  # finished columns, shared by sentences parsed with this grammar
+        self.finalized = False
+        self._intern(start_symbol)
         # Read the input grammar files
         for file in files:
             self.add_rules_from_file(file)
+        self.finalize()  # all per-grammar work happens here, not once per sentence
+
+    def _intern(self, symbol: str) -> int:
+        """Return the id of symbol, assigning a fresh one if it is new."""
+        id = self._sym2id.get(symbol)
+        if id is None:
+            id = len(self._id2sym)
+            self._sym2id[symbol] = id
+            self._id2sym.append(symbol)
+            self.is_nt.append(False)
+        return id
 
     def add_rules_from_file(self, file: Path) -> None:
         """Add rules to this grammar from a file (one rule per line).
         Each rule is preceded by a normalized probability p,
         and we take -log2(p) to be the rule's weight."""
+        if self.finalized:
+            raise RuntimeError("Can't add rules to a grammar that has been finalized")
+        weights: Dict[str, float] = {}  # -log2 of each probability string seen so far; big grammars repeat them a lot
         with open(file, "r") as f:
             for line in f:
                 # remove any comment from end of line, and any trailing whitespace
@@ -457,20 +856,210 @@ class Grammar:
                     continue
                 # Parse tab-delimited line of format <probability>\t<lhs>\t<rhs>
                 _prob, lhs, _rhs = line.split("\t")
-                prob = float(_prob)
+                weight = weights.get(_prob)
+                if weight is None:
+                    weight = weights[_prob] = -math.log2(float(_prob))
                 rhs = tuple(_rhs.split())
-                rule = Rule(lhs=lhs, rhs=rhs, weight=-math.log2(prob))
-                if lhs not in self._expansions:
-                    self._expansions[lhs] = []
-                self._expansions[lhs].append(rule)
+                if len(rhs) > DOT_MASK:
+                    raise ValueError(f"Can't handle rules with more than {DOT_MASK} symbols: {line}")
+                rule = Rule(lhs=lhs, rhs=rhs, weight=weight)
+                lhs_id = self._intern(lhs)
+                self.is_nt[lhs_id] = True
+                if lhs_id not in self._expansions:
+                    self._expansions[lhs_id] = []
+                self._expansions[lhs_id].append(len(self.rules))
+                self.rules.append(rule)
+                self.rule_lhs.append(lhs_id)
+                self.rule_rhs.append(tuple(self._intern(symbol) for symbol in rhs))
+                self.rule_weight.append(rule.weight)
+
+    def finalize(self) -> None:
+        """Build all the tables that the parser uses, once all rules are in.
+        (They can't be built earlier: e.g., a symbol that so far has only
+        appeared on right-hand sides might still turn out to be a nonterminal.)
+        The grammar can't be changed afterwards."""
+        self._build_next_tables()
+        self._build_left_corner_tables()
+        self.finalized = True
+
+    def numba_arrays(self) -> Optional[earley_numba.GrammarArrays]:
+        """The tables that earley_numba needs, built the first time they are
+        asked for.  None if earley_numba can't be used: numba isn't
+        installed, or the grammar has rules with empty right-hand sides,
+        which earley_numba doesn't handle."""
+        assert self.finalized
+        if self._arrays is None and all(self.rule_rhs) and load_earley_numba():
+            self._arrays = earley_numba.GrammarArrays(self)
+        return self._arrays
+
+    def _build_next_tables(self) -> None:
+        """Fill in next_sym and next_kind for every rule."""
+        self.next_sym = [list(rhs) + [None] for rhs in self.rule_rhs]
+        self.next_kind = [[NONTERMINAL if self.is_nt[symbol] else TERMINAL for symbol in rhs] + [COMPLETE]
+                          for rhs in self.rule_rhs]
+
+    def _build_left_corner_tables(self) -> None:
+        """Fill in nullable and left_corners."""
+        changed = True
+        while changed:  # iterate to a fixpoint
+            changed = False
+            for lhs, rhs in zip(self.rule_lhs, self.rule_rhs):
+                if lhs not in self.nullable and all(symbol in self.nullable for symbol in rhs):
+                    self.nullable.add(lhs)
+                    changed = True
+
+        # The symbols that can come first in a right-hand side of each nonterminal
+        direct: Dict[int, Set[int]] = {lhs: set() for lhs in self._expansions}
+        for lhs, rhs in zip(self.rule_lhs, self.rule_rhs):
+            for symbol in rhs:
+                direct[lhs].add(symbol)
+                if symbol not in self.nullable:
+                    break
+
+        # The left corners of A are the terminals reachable from A in that relation
+        for nonterminal in self._expansions:
+            terminals: Set[int] = set()
+            visited = {nonterminal}
+            stack = [nonterminal]
+            while stack:
+                for symbol in direct[stack.pop()]:
+                    if not self.is_nt[symbol]:
+                        terminals.add(symbol)
+                    elif symbol not in visited:
+                        visited.add(symbol)
+                        stack.append(symbol)
+            self.left_corners[nonterminal] = frozenset(terminals)
+
+    def predictions(self, nonterminal: int, lookahead: Optional[int]) -> Tuple[int, ...]:
+        """Ids of the rules expanding nonterminal that could begin with the
+        terminal `lookahead`.  If `lookahead` is None (the end of the
+        sentence), that's all of them.  Results are memoized."""
+        return self.predictions_for(lookahead)[nonterminal]
+
+    def predictions_for(self, lookahead: Optional[int]) -> PredictionTable:
+        """The memo table for predictions() with this lookahead.  Looking
+        things up in it directly hashes just the nonterminal's id, rather
+        than building and hashing a (nonterminal, lookahead) pair."""
+        table = self._predictions.get(lookahead)
+        if table is None:
+            table = self._predictions[lookahead] = PredictionTable(self, lookahead)
+        return table
+
+    def _can_begin_with(self, rule_id: int, terminal: int) -> bool:
+        """Could the right-hand side of this rule derive a string that begins with terminal?
+        (We say yes if it could derive the empty string, since then the terminal might come later.)"""
+        for symbol in self.rule_rhs[rule_id]:
+            if not self.is_nt[symbol]:
+                return symbol == terminal
+            if terminal in self.left_corners[symbol]:
+                return True
+            if symbol not in self.nullable:
+                return False
+        return True
 
     def expansions(self, lhs: str) -> Iterable[Rule]:
         """Return an iterable collection of all rules with a given lhs"""
-        return self._expansions[lhs]
+        return [self.rules[rule_id] for rule_id in self._expansions[self._sym2id[lhs]]]
 
     def is_nonterminal(self, symbol: str) -> bool:
         """Is symbol a nonterminal symbol?"""
-        return symbol in self._expansions
+        return symbol in self._sym2id and self.is_nt[self._sym2id[symbol]]
+
+    def symbol_id(self, symbol: str) -> int:
+        """The id of symbol, or -1 if the grammar has never seen it."""
+        return self._sym2id.get(symbol, -1)
+
+    def symbol(self, id: int) -> str:
+        """The symbol with the given id."""
+        return self._id2sym[id]
+
+    def next_symbol(self, item: Item) -> Optional[int]:
+        """What's the next, unprocessed symbol (terminal, non-terminal, or None) in this partially matched rule?"""
+        return self.next_sym[item >> RULE_SHIFT][(item >> DOT_SHIFT) & DOT_MASK]
+
+    def with_dot_advanced(self, item: Item) -> Item:
+        if self.next_symbol(item) is None:
+            raise IndexError("Can't advance the dot past the end of the rule")
+        return item + DOT_ONE
+
+    def item_repr(self, item: Item) -> str:
+        """Human-readable representation string used when printing this item."""
+        rule_id, dot_position, start_position = unpack_item(item)
+        dotted_rules = self._dotted_rules.get(rule_id)
+        if dotted_rules is None:  # spell out this rule with the dot in each position, just once
+            DOT = "·"
+            rule = self.rules[rule_id]
+            dotted_rules = tuple(f"{rule.lhs} → {' '.join(rule.rhs[:i] + (DOT,) + rule.rhs[i:])}"
+                                 for i in range(len(rule.rhs) + 1))
+            self._dotted_rules[rule_id] = dotted_rules
+        return f"({start_position}, {dotted_rules[dot_position]})"  # matches notation on slides
+
+class PredictionTable(dict):
+    """Maps each nonterminal to Grammar.predictions(nonterminal, lookahead)
+    for a fixed lookahead, computing entries the first time they are asked for."""
+
+    def __init__(self, grammar: Grammar, lookahead: Optional[int]) -> None:
+        super().__init__()
+        self._grammar = grammar
+        self._lookahead = lookahead
+
+    def __missing__(self, nonterminal: int) -> Tuple[int, ...]:
+        grammar, lookahead = self._grammar, self._lookahead
+        rule_ids = tuple(rule_id for rule_id in grammar._expansions[nonterminal]
+                         if lookahead is None or grammar._can_begin_with(rule_id, lookahead))
+        self[nonterminal] = rule_ids
+        return rule_ids
+
+
+class PrefixCharts:
+    """A bounded cache of finished chart columns, keyed by the words
+    they were built from, that the pure-Python parser shares across
+    sentences.  Column i of a chart depends only on the grammar and the
+    first i+1 words (the last of which is the lookahead), and never
+    changes once it is finished.  So two sentences that begin with the
+    same k words can share their first k columns, and the second one
+    need only be parsed from column k on.
+
+    We keep one entry per sentence, and forget the least recently used
+    sentences once more than `maxcolumns` columns are kept in all."""
+
+    def __init__(self, maxcolumns: int = 64) -> None:
+        self.maxcolumns = maxcolumns
+        self._columns: OrderedDict[Tuple[str, ...], Tuple[Agenda, ...]] = OrderedDict()
+        self._size = 0  # total number of columns in self._columns
+
+    def lookup(self, tokens: List[str]) -> Tuple[Agenda, ...]:
+        """The finished columns for the longest prefix of tokens that some
+        stored sentence shares, i.e., columns 0 to k-1 for a prefix of k words."""
+        best, best_sentence = 0, None
+        for sentence in self._columns:
+            k = 0
+            for word, stored_word in zip(tokens, sentence):
+                if word != stored_word:
+                    break
+                k += 1
+            if k > best:
+                best, best_sentence = k, sentence
+        if best_sentence is None:
+            return ()
+        self._columns.move_to_end(best_sentence)
+        return self._columns[best_sentence][:best]
+
+    def store(self, tokens: List[str], cols: List[Agenda]) -> None:
+        """Remember the columns of a chart for its sentence.
+        (The last column isn't included, since it had no lookahead.)"""
+        sentence = tuple(tokens)
+        if sentence in self._columns:
+            self._columns.move_to_end(sentence)
+            return
+        if len(sentence) > self.maxcolumns:
+            return
+        self._columns[sentence] = tuple(cols[:len(sentence)])
+        self._size += len(sentence)
+        while self._size > self.maxcolumns:
+            _, evicted = self._columns.popitem(last=False)
+            self._size -= len(evicted)
+
 
 def weight_to_prob(weight):
     prob = 2**(-weight)
@@ -484,14 +1073,26 @@ def main():
 
     grammar = Grammar(args.start_symbol, args.grammar)
 
+    # Say so if we can't use the compiled parser as asked
+    use_numba = args.numba
+    if use_numba and (args.logging_level <= logging.DEBUG or args.progress):
+        log.warning("Ignoring --numba: the compiled parser can't log its steps or show progress bars")
+        use_numba = False
+    elif use_numba and not load_earley_numba():
+        log.warning("Ignoring --numba: numba is not installed")
+        use_numba = False
+    elif use_numba and grammar.numba_arrays() is None:
+        log.warning("Ignoring --numba: the compiled parser can't handle rules with empty right-hand sides")
+        use_numba = False
+
     with open(args.sentences) as f:
         for sentence in f.readlines():
             sentence = sentence.strip()
             if sentence != "":  # skip blank lines
                 # analyze the sentence
                 log.debug("=" * 70)
-                log.debug(f"Parsing sentence: {sentence}")
-                chart = EarleyChart(sentence.split(), grammar, progress=args.progress)
+                log.debug("Parsing sentence: %s", sentence)
+                chart = EarleyChart(sentence.split(), grammar, progress=args.progress, use_numba=use_numba)
                 final_item = chart.accepted_with_item()
                 # log.info(sentence)
                 if final_item is None: